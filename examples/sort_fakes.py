@@ -59,7 +59,9 @@ def compare_fakes(image_dir, results_dir, results_suffix_list, time_file):
         lc_filename = os.path.join(results_dir, "lc_%s.txt" % results_suffix)
         lc_list = stamper.load_lightcurves(lc_filename)
 
-        stamp_filename = os.path.join(results_dir, "ps_%s.txt" % results_suffix)
+        stamp_filename = os.path.join(results_dir, "ps_%s.npy" % results_suffix)
+        if not os.path.isfile(stamp_filename):
+            stamp_filename = os.path.join(results_dir, "ps_%s.txt" % results_suffix)
         stamps = stamper.load_stamps(stamp_filename)
 
         result_filename = os.path.join(results_dir, "results_%s.txt" % results_suffix)
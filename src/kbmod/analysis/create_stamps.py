@@ -100,13 +100,17 @@ class CreateStamps(object):
         Load the stamps.
 
         Arguments:
-            stamp_filename - The filename of the stamp data.
+            stamp_filename - The filename of the stamp data. Either a
+                binary .npy file or an older text file.
 
         Returns:
             stamps - A list of np.arrays containing the stamps
                      for each result.
         """
-        stamps = np.genfromtxt(stamp_filename)
+        if stamp_filename.endswith(".npy"):
+            stamps = np.load(stamp_filename)
+        else:
+            stamps = np.genfromtxt(stamp_filename)
         if len(np.shape(stamps)) < 2:
             stamps = np.array([stamps])
 
@@ -1001,6 +1005,24 @@ class CNNFilter:
         fig.colorbar(im, ax=ax2)
 
 
+def find_stamp_file(results_dir, suffix):
+    """
+    Find the file with the coadded stamps of a set of results.
+
+    Arguments:
+        results_dir - The directory containing the results files.
+        suffix - The suffix of the results files.
+
+    Returns:
+        stamp_filename - The path of the binary ps_<suffix>.npy file, or
+            of the older text ps_<suffix>.txt file if there is no binary one.
+    """
+    stamp_filename = os.path.join(results_dir, "ps_%s.npy" % suffix)
+    if not os.path.isfile(stamp_filename):
+        stamp_filename = os.path.join(results_dir, "ps_%s.txt" % suffix)
+    return stamp_filename
+
+
 def load_stamps(results_dir, im_dir, suffix):
 
     image_list = sorted(os.listdir(im_dir))
@@ -1011,7 +1033,7 @@ def load_stamps(results_dir, im_dir, suffix):
     psi_filename = os.path.join(results_dir, "psi_{}.txt".format(suffix))
     phi_filename = os.path.join(results_dir, "phi_{}.txt".format(suffix))
     lc_index_filename = os.path.join(results_dir, "lc_index_%s.txt" % suffix)
-    stamp_filename = os.path.join(results_dir, "ps_%s.txt" % suffix)
+    stamp_filename = find_stamp_file(results_dir, suffix)
     result_filename = os.path.join(results_dir, "results_%s.txt" % suffix)
 
     result_exists = os.path.isfile(result_filename)
@@ -1,8 +1,10 @@
+import io
 import os
 import csv
 import time
 import heapq
-import multiprocessing as mp
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from collections import OrderedDict
 
 import numpy as np
@@ -10,14 +12,157 @@ import astropy.units as u
 from astropy.io import fits
 from astropy.wcs import WCS
 import astropy.coordinates as astroCoords
+from astropy.coordinates import get_body_barycentric, solar_system_ephemeris
+from astropy.time import Time
+from scipy.linalg import solve_triangular
 from scipy.special import erfinv #import mpmath
-from skimage import measure
 from sklearn.cluster import DBSCAN, OPTICS
 
 from .image_info import *
 import kbmod.search as kb
 
 
+def _load_visit(args):
+    """
+    Load a single image file for Interface.load_images().
+    INPUT-
+        args : tuple
+            A tuple of (full_file_path, visit_str, time_stamp, psf_val,
+            default_psf, mjd_lims) where time_stamp is the time from the
+            time file (or -1.0 if there is none) and psf_val is the
+            image-specific PSF value (or None to use default_psf).
+    OUTPUT-
+        visit : tuple or None
+            A tuple of (full_file_path, img, time_stamp) for the loaded
+            image or None if the image was skipped.
+    """
+    full_file_path, visit_str, time_stamp, psf_val, default_psf, mjd_lims = args
+
+    # If we didn't previously load a time stamp and need it for the time based
+    # filtering, read it from the primary header (the same MJD keyword
+    # layered_image uses) so that rejected files are never fully loaded.
+    if time_stamp <= 0.0 and mjd_lims is not None:
+        header_time = float(fits.getheader(full_file_path, 0).get("MJD", 0.0))
+        if header_time > 0.0 and (header_time < mjd_lims[0] or header_time > mjd_lims[1]):
+            return None
+
+    # Check if the image has a specific PSF.
+    psf = default_psf
+    if psf_val is not None:
+        psf = kb.psf(psf_val)
+
+    # Load the image file.
+    img = kb.layered_image(full_file_path, psf)
+
+    # If we didn't previously load a time stamp, check whether the file contains
+    # that information.
+    if time_stamp <= 0.0:
+        time_stamp = img.get_time()  # default of 0.0
+        # Skip images without valid times.
+        if time_stamp <= 0.0:
+            print("WARNING: No timestamp provided for visit %s. Skipping." % visit_str)
+            return None
+    else:
+        # If we have a valid timestamp from the file, use that for the image.
+        img.set_time(time_stamp)
+
+    return (full_file_path, img, time_stamp)
+
+
+def _boolean_idx(lc_index, num_images):
+    """
+    Convert lists of valid light curve indices into rows of 0/1 flags as
+    used by the C++ stamp generation functions.
+    INPUT-
+        lc_index : list
+            A list of arrays with the valid indices for each result, such as
+            are stored in keep['lc_index'].
+        num_images : int
+            The number of images (length of each row).
+    OUTPUT-
+        boolean_idx : list
+            A list of lists of ints with a 1 for each valid index and a 0
+            otherwise.
+    """
+    num_results = len(lc_index)
+    mask = np.zeros((num_results, num_images), dtype=np.int32)
+    if num_results > 0:
+        rows = np.repeat(np.arange(num_results), [len(x) for x in lc_index])
+        cols = np.concatenate([np.asarray(x, dtype=np.int64) for x in lc_index])
+        mask[rows, cols] = 1
+    return mask.tolist()
+
+
+def _clipped_average_curve(psi_curve, phi_curve, index, num_clipped=5, n_sigma=4, lower_lh_limit=-100):
+    """
+    Apply the clipped-average filter to a single pair of curves. The kbmod
+    functions used here release the GIL, so this can be run from several
+    threads at once. See PostProcess._clipped_average().
+    """
+    max_lh_index = kb.clipped_ave_filtered_indices(psi_curve, phi_curve, num_clipped, n_sigma, lower_lh_limit)
+    new_lh = -1.0
+    if len(max_lh_index) > 0:
+        new_lh = kb.calculate_likelihood_psi_phi(psi_curve[max_lh_index], phi_curve[max_lh_index])
+    return (index, max_lh_index, new_lh)
+
+
+@functools.lru_cache(maxsize=8)
+def _sigmaG_coeff(lower_percentile, upper_percentile):
+    """
+    Compute the coefficient that converts the distance between two percentiles
+    of a Gaussian distribution into its standard deviation.
+    INPUT-
+        lower_percentile : float
+            The lower percentile, in the range [0, 100].
+        upper_percentile : float
+            The upper percentile, in the range [0, 100].
+    OUTPUT-
+        coeff : float
+            The sigmaG coefficient.
+    """
+    # Invert the Gaussian CDF at both percentiles with a single erfinv call.
+    z = np.array([lower_percentile, upper_percentile], dtype=float) / 100
+    x = np.sqrt(2) * erfinv(2 * z - 1)
+    return float(1 / (x[1] - x[0]))
+
+
+@functools.lru_cache(maxsize=8)
+def _moment_kernels(radius):
+    """
+    Compute the pixel offset grids used to find the central moments of stamps
+    with a given radius. These only depend on the radius, so they are cached.
+    INPUT-
+        radius : int
+            The radius of the stamps.
+    OUTPUT-
+        dy : numpy array
+            The (read only) row offset of each pixel from the center.
+        dx : numpy array
+            The (read only) column offset of each pixel from the center.
+        kernels : numpy array
+            A read only (5, number of pixels) matrix with the flattened weights
+            for the xx, yy, xy, x, and y central moments.
+    """
+    dy, dx = np.mgrid[-radius : radius + 1, -radius : radius + 1]
+    kernels = np.stack([dy**2, dx**2, dy * dx, dy, dx]).reshape(5, -1).astype(np.float32)
+    # The offsets are broadcast against whole chunks of stamps when finding the
+    # peaks, so they use the smallest integer type that holds them (int8 for
+    # all the usual radii).
+    offset_type = np.min_scalar_type(-radius - 1)
+    dy = dy.astype(offset_type)
+    dx = dx.astype(offset_type)
+    for arr in (dy, dx, kernels):
+        arr.setflags(write=False)
+    return dy, dx, kernels
+
+
+# Ecliptic angles already computed by Interface._calc_ecliptic_angle(), keyed
+# by the WCS header, pixel, and step. The oldest entries are dropped once there
+# are more than _ECLIPTIC_ANGLE_CACHE_SIZE of them.
+_ecliptic_angle_cache = OrderedDict()
+_ECLIPTIC_ANGLE_CACHE_SIZE = 16
+
+
 class SharedTools:
     """
     This class manages tools that are shared by the classes Interface and
@@ -34,6 +179,9 @@ class SharedTools:
         dictionary should be added here. This dictionary gets passed into and
         out of most Interface and PostProcess methods, getting altered and/or
         replaced by filtering along the way.
+
+        The 'psi_curves' and 'phi_curves' are stored as contiguous float32
+        arrays of shape (number of results, number of images).
         """
         keep = {
             "stamps": [],
@@ -43,8 +191,8 @@ class SharedTools:
             "lc": [],
             "lc_index": [],
             "all_stamps": [],
-            "psi_curves": [],
-            "phi_curves": [],
+            "psi_curves": np.empty((0, 0), dtype=np.float32),
+            "phi_curves": np.empty((0, 0), dtype=np.float32),
             "final_results": ...,
         }
         return keep
@@ -103,17 +251,13 @@ class Interface(SharedTools):
         # empty if no time file is specified.
         image_time_dict = OrderedDict()
         if time_file:
-            visit_nums, visit_times = np.genfromtxt(time_file, unpack=True)
-            for visit_num, visit_time in zip(visit_nums, visit_times):
-                image_time_dict[str(int(visit_num))] = visit_time
+            image_time_dict = self._load_visit_values(time_file)
 
         # Load a mapping from visit numbers to PSFs. This dictionary stays
         # empty if no time file is specified.
         image_psf_dict = OrderedDict()
         if psf_file:
-            visit_nums, psf_vals = np.genfromtxt(psf_file, unpack=True)
-            for visit_num, visit_psf in zip(visit_nums, psf_vals):
-                image_psf_dict[str(int(visit_num))] = visit_psf
+            image_psf_dict = self._load_visit_values(psf_file)
 
         # Retrieve the list of visits (file names) in the data directory.
         patch_visits = sorted(os.listdir(im_filepath))
@@ -122,17 +266,14 @@ class Interface(SharedTools):
         id_start = visit_in_filename[0]
         id_end = visit_in_filename[1]
 
-        # Load the images themselves.
-        filenames = []
-        images = []
-        visit_times = []
+        # Collect the arguments for each image to load. Check if we can prune the
+        # file based on the timestamp. We do this before the file load to save time,
+        # but might have to recheck if the time stamp is stored in the file itself.
+        load_args = []
         for visit_file in np.sort(patch_visits):
             full_file_path = "{0:s}/{1:s}".format(im_filepath, visit_file)
             visit_str = str(int(visit_file[id_start:id_end]))
 
-            # Check if we can prune the file based on the timestamp. We do this
-            # before the file load to save time, but might have to recheck if the
-            # time stamp is stored in the file itself.
             time_stamp = -1.0
             if visit_str in image_time_dict:
                 time_stamp = image_time_dict[visit_str]
@@ -140,31 +281,28 @@ class Interface(SharedTools):
                     if time_stamp < mjd_lims[0] or time_stamp > mjd_lims[1]:
                         continue
 
-            # Check if the image has a specific PSF.
-            psf = default_psf
-            if visit_str in image_psf_dict:
-                psf = kb.psf(image_psf_dict[visit_str])
-
-            # Load the image file.
-            img = kb.layered_image(full_file_path, psf)
-
-            # If we didn't previously load a time stamp, check whether the file contains
-            # that information and retry the time based filteriing.
-            if time_stamp <= 0.0:
-                time_stamp = img.get_time()  # default of 0.0
-                # Skip images without valid times.
-                if time_stamp <= 0.0:
-                    print("WARNING: No timestamp provided for visit %s. Skipping." % visit_str)
-                    continue
-                # Skip images with times outside the specified range.
-                if mjd_lims is not None:
-                    if time_stamp < mjd_lims[0] or time_stamp > mjd_lims[1]:
-                        continue
-            else:
-                # If we have a valid timestamp from the file, use that for the image.
-                img.set_time(time_stamp)
+            load_args.append(
+                (
+                    full_file_path,
+                    visit_str,
+                    time_stamp,
+                    image_psf_dict.get(visit_str),
+                    default_psf,
+                    mjd_lims,
+                )
+            )
+
+        # Load the images themselves.
+        loaded = [_load_visit(args) for args in load_args]
 
-            # Save the file, time, and image information.
+        # Save the file, time, and image information in the original order.
+        filenames = []
+        images = []
+        visit_times = []
+        for visit in loaded:
+            if visit is None:
+                continue
+            full_file_path, img, time_stamp = visit
             filenames.append(full_file_path)
             images.append(img)
             visit_times.append(time_stamp)
@@ -188,6 +326,28 @@ class Interface(SharedTools):
 
         return (stack, img_info, ec_angle)
 
+    def _load_visit_values(self, filename):
+        """
+        Load a mapping from visit number to a per-visit value, such as the
+        visit time or PSF, from a text file.
+        INPUT-
+            filename : string
+                The name of a file with two whitespace separated columns: the
+                visit number and the value. Anything after a '#' is ignored.
+        OUTPUT-
+            visit_dict : OrderedDict
+                A dictionary mapping the visit number (as a string) to the
+                value (as a float).
+        """
+        visit_dict = OrderedDict()
+        with open(filename, "r") as f:
+            for line in f:
+                values = line.split("#", 1)[0].split()
+                if len(values) == 0:
+                    continue
+                visit_dict[str(int(float(values[0])))] = float(values[1])
+        return visit_dict
+
     def save_results(self, res_filepath, out_suffix, keep):
         """
         This function saves results from a given search method (either region
@@ -204,38 +364,45 @@ class Interface(SharedTools):
         print("---------------------------------------")
         print("Saving Results")
         print("---------------------------------------", flush=True)
-        np.savetxt(
-            "%s/results_%s.txt" % (res_filepath, out_suffix),
-            np.array(keep["results"])[keep["final_results"]],
-            fmt="%s",
-        )
-        with open("%s/lc_%s.txt" % (res_filepath, out_suffix), "w") as f:
-            writer = csv.writer(f)
-            writer.writerows(np.array(keep["lc"])[keep["final_results"]])
-        with open("%s/psi_%s.txt" % (res_filepath, out_suffix), "w") as f:
-            writer = csv.writer(f)
-            writer.writerows(np.array(keep["psi_curves"])[keep["final_results"]])
-        with open("%s/phi_%s.txt" % (res_filepath, out_suffix), "w") as f:
-            writer = csv.writer(f)
-            writer.writerows(np.array(keep["phi_curves"])[keep["final_results"]])
-        with open("%s/lc_index_%s.txt" % (res_filepath, out_suffix), "w") as f:
-            writer = csv.writer(f)
-            writer.writerows(np.array(keep["lc_index"], dtype=object)[keep["final_results"]])
-        with open("%s/times_%s.txt" % (res_filepath, out_suffix), "w") as f:
-            writer = csv.writer(f)
-            writer.writerows(np.array(keep["times"], dtype=object)[keep["final_results"]])
+        final_results = keep["final_results"]
+        if final_results is ...:
+            final_results = np.arange(len(keep["results"]))
+        # Index the list of trajectories directly rather than building an object
+        # array of them, and write out their string forms.
+        with open("%s/results_%s.txt" % (res_filepath, out_suffix), "w") as f:
+            f.writelines("%s\n" % keep["results"][i] for i in final_results)
+
+        # The light curves are uniform length numeric arrays, so they can be
+        # formatted by numpy into a memory buffer and written out in one go.
+        for key, prefix in (("lc", "lc"), ("psi_curves", "psi"), ("phi_curves", "phi")):
+            buf = io.BytesIO()
+            np.savetxt(buf, np.asarray(keep[key])[final_results], fmt="%.9g", delimiter=",")
+            with open("%s/%s_%s.txt" % (res_filepath, prefix, out_suffix), "wb") as f:
+                f.write(buf.getvalue())
+
+        # The valid indices and times differ in length between results, so they
+        # are still written with csv, but into a memory buffer first.
+        for key in ("lc_index", "times"):
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerows([keep[key][i] for i in final_results])
+            with open("%s/%s_%s.txt" % (res_filepath, key, out_suffix), "w") as f:
+                f.write(buf.getvalue())
+
         np.savetxt(
             "%s/filtered_likes_%s.txt" % (res_filepath, out_suffix),
-            np.array(keep["new_lh"])[keep["final_results"]],
+            np.array(keep["new_lh"])[final_results],
             fmt="%.4f",
         )
-        np.savetxt(
-            "%s/ps_%s.txt" % (res_filepath, out_suffix),
-            np.array(keep["stamps"]).reshape(len(np.array(keep["stamps"])), 441),
-            fmt="%.4f",
+        # Stamps are saved in numpy's binary format to avoid formatting each
+        # pixel value as text.
+        np.save(
+            "%s/ps_%s.npy" % (res_filepath, out_suffix),
+            np.asarray(keep["stamps"], dtype=np.float32).reshape(-1, 441),
+            allow_pickle=False,
         )
-        stamps_to_save = np.array(keep["all_stamps"])
-        np.save("%s/all_ps_%s.npy" % (res_filepath, out_suffix), stamps_to_save)
+        stamps_to_save = np.ascontiguousarray(keep["all_stamps"], dtype=np.float32)
+        np.save("%s/all_ps_%s.npy" % (res_filepath, out_suffix), stamps_to_save, allow_pickle=False)
 
     def _calc_ecliptic_angle(self, wcs, center_pixel=(1000, 2000), step=12):
         """
@@ -265,35 +432,79 @@ class Interface(SharedTools):
         Note
         ----
         It is not neccessary to calculate this angle for each image in an
-        image set if they have all been warped to a common WCS.
+        image set if they have all been warped to a common WCS. Results
+        are cached by the WCS header, so repeated calls with the same WCS
+        do not repeat the computation (unless the WCS uses distortion lookup
+        tables, which are not part of the header).
 
         See Also
         --------
         run_search.do_gpu_search
         """
-        # pick a starting pixel approximately near the center of the image
-        # convert it to ecliptic coordinates
-        start_pixel = np.array(center_pixel)
-        start_pixel_coord = astroCoords.SkyCoord.from_pixel(
-            start_pixel[0], 
-            start_pixel[1], 
+        # Distortion lookup tables are not part of the header, so a WCS that
+        # uses them cannot be identified by its header and is not cached.
+        if any(table is not None for table in (wcs.cpdis1, wcs.cpdis2, wcs.det2im1, wcs.det2im2)):
+            return float(self._calc_ecliptic_angles(wcs, [center_pixel], step)[0])
+
+        key = (wcs.to_header_string(relax=True), float(center_pixel[0]), float(center_pixel[1]), step)
+        angle = _ecliptic_angle_cache.get(key)
+        if angle is None:
+            angle = float(self._calc_ecliptic_angles(wcs, [center_pixel], step)[0])
+            _ecliptic_angle_cache[key] = angle
+            if len(_ecliptic_angle_cache) > _ECLIPTIC_ANGLE_CACHE_SIZE:
+                _ecliptic_angle_cache.popitem(last=False)
+        return angle
+
+    def _calc_ecliptic_angles(self, wcs, center_pixels, step=12):
+        """
+        Vectorized version of `_calc_ecliptic_angle` that computes the angle
+        for many pixel positions with a single round-trip through astropy.
+
+        Parameters
+        ----------
+        wcs : `astropy.wcs.WCS`
+            World Coordinate System object.
+        center_pixels : `numpy.ndarray`
+            Array of shape (N, 2) with the pixel coordinates at which to
+            compute the angles.
+        step : `float` or `int`
+            Size of step, in arcseconds, used to find the pixel
+            coordinates of the second pixel in the image parallel to
+            the ecliptic.
+
+        Returns
+        -------
+        angles : `numpy.ndarray`
+            Array of N angles the projected unit-vector parallel to the
+            ecliptic closes with the image axes.
+
+        See Also
+        --------
+        _calc_ecliptic_angle
+        """
+        # convert the starting pixels to ecliptic coordinates
+        start_pixels = np.asarray(center_pixels, dtype=float).reshape(-1, 2)
+        start_pixel_coords = astroCoords.SkyCoord.from_pixel(
+            start_pixels[:, 0],
+            start_pixels[:, 1],
             wcs)
-        start_ecliptic_coord = start_pixel_coord.geocentrictrueecliptic
+        start_ecliptic_coords = start_pixel_coords.geocentrictrueecliptic
 
-        # pick a guess pixel by moving parallel to the ecliptic
-        # convert it to pixel coordinates for the given WCS
-        guess_ecliptic_coord = astroCoords.SkyCoord(
-            start_ecliptic_coord.lon + step*u.arcsec,
-            start_ecliptic_coord.lat,
+        # pick guess pixels by moving parallel to the ecliptic
+        # convert them to pixel coordinates for the given WCS
+        guess_ecliptic_coords = astroCoords.SkyCoord(
+            start_ecliptic_coords.lon + step*u.arcsec,
+            start_ecliptic_coords.lat,
             frame="geocentrictrueecliptic")
-        guess_pixel_coord = guess_ecliptic_coord.to_pixel(wcs)
-        
-        # calculate the distance, in pixel coordinates, between the guess and 
-        # the start pixel. Calculate the angle that represents in the image.
-        x_dist, y_dist = np.array(guess_pixel_coord) - start_pixel
-        return np.arctan2(y_dist, x_dist) 
-
-    def _calc_barycentric_corr(self, wcslist, mjdlist, x_size, y_size, dist):
+        guess_x, guess_y = guess_ecliptic_coords.to_pixel(wcs)
+
+        # calculate the distance, in pixel coordinates, between the guesses and
+        # the start pixels. Calculate the angles that represents in the image.
+        x_dist = guess_x - start_pixels[:, 0]
+        y_dist = guess_y - start_pixels[:, 1]
+        return np.arctan2(y_dist, x_dist)
+
+    def _calc_barycentric_corr(self, wcslist, mjdlist, x_size, y_size, dist, ephemeris="de432s"):
         """
         This function calculates the barycentric corrections between wcslist[0]
         and each frame in wcslist.
@@ -301,19 +512,25 @@ class Interface(SharedTools):
         an object that is stationary in barycentric coordinates, at a barycentric
         radius of dist au. This function returns a linear fit to the barycentric
         correction as a function of position on the image with wcs0.
+        The observer positions come from the given astropy solar system
+        ephemeris ("builtin" does not need jplephem or a download).
         """
 
         # make grid with observer-centric RA/DEC of wcs0
+        wcs0 = wcslist[0]
         xlist, ylist = np.mgrid[0:x_size, 0:y_size]
         xlist = xlist.flatten()
         ylist = ylist.flatten()
         cobs = wcs0.pixel_to_world(xlist, ylist)
 
+        # compute the observer's barycentric position at all times at once
+        with solar_system_ephemeris.set(ephemeris):
+            obs_pos_list = get_body_barycentric("earth", Time(mjdlist, format="mjd"))
+
         # convert this grid to barycentric x,y,z, assuming distance r
         # [obs_to_bary_wdist()]
-        with solar_system_ephemeris.set("de432s"):
-            obs_pos = get_body_barycentric("earth", Time(mjdlist[0], format="mjd"))
-        cobs.represention_type = "cartesian"
+        obs_pos = obs_pos_list[0]
+        cobs.representation_type = "cartesian"
         # barycentric distance of observer
         r2_obs = obs_pos.x * obs_pos.x + obs_pos.y * obs_pos.y + obs_pos.z * obs_pos.z
         # calculate distance r along line of sight that gives correct
@@ -324,26 +541,38 @@ class Interface(SharedTools):
         bary_dist = dist * u.au
         r = -dot + np.sqrt(bary_dist * bary_dist - r2_obs + dot * dot)
         # barycentric coordinate is observer position + r * line of sight
-        cbary = SkyCoord(obs_pos.x + r * c.x, obs_pos.y + r * c.y, obs_pos.z + r * c.z)
+        cbary = astroCoords.SkyCoord(
+            obs_pos.x + r * cobs.x,
+            obs_pos.y + r * cobs.y,
+            obs_pos.z + r * cobs.z,
+            representation_type="cartesian",
+        )
+
+        # the design matrix of the linear fit is the same for every frame, so
+        # decompose it once and reuse it for all of the fits
+        A = np.stack([np.ones_like(xlist), xlist, ylist], axis=-1)
+        Q, R = np.linalg.qr(A)
 
         baryCoeff = np.zeros((len(wcslist), 6))
         for i in range(1, len(wcslist)):  # corections for wcslist[0] are 0
             # hold the barycentric coordinates constant and convert to new frame
             # by subtracting the observer's new position and converting to RA/DEC and pixel
             # [bary_to_obs_fast()]
-            with solar_system.ephemeris.set("de432s"):
-                obs_pos = get_body_barycentric("earth", Time(mjdlist[i], format="mjd"))
-            c = SkyCoord(cbary.x - obs_pos.x, cbary.y - obs_pos.y, cbary.z - obs_pos.z)
+            obs_pos = obs_pos_list[i]
+            c = astroCoords.SkyCoord(
+                cbary.x - obs_pos.x,
+                cbary.y - obs_pos.y,
+                cbary.z - obs_pos.z,
+                representation_type="cartesian",
+            )
             c.representation_type = "spherical"
             pix = wcslist[i].world_to_pixel(c)
 
-            # do linear fit to get coefficients
-            ones = np.ones_like(xlist)
-            A = np.stack([ones, xlist, ylist], axis=-1)
-            coef_x, _, _, _ = lstsq(A_x, (pix[0] - xlist))
-            coef_y, _, _, _ = lstsq(A_y, (pix[1] - ylist))
-            baryCoeff[i, 0:3] = coef_x
-            baryCoeff[i, 3:6] = coef_y
+            # do linear fit to get coefficients for x and y together
+            rhs = np.stack([pix[0] - xlist, pix[1] - ylist], axis=1)
+            coef = solve_triangular(R, Q.T @ rhs)
+            baryCoeff[i, 0:3] = coef[:, 0]
+            baryCoeff[i, 3:6] = coef[:, 1]
 
         return baryCoeff
 
@@ -368,6 +597,10 @@ class PostProcess(SharedTools):
         self.mask_bits_dict = config["mask_bits_dict"]
         self.flag_keys = config["flag_keys"]
         self.repeated_flag_keys = config["repeated_flag_keys"]
+
+        # Precompute the bit masks used by apply_mask.
+        self._flags = sum(2 ** self.mask_bits_dict[bit] for bit in self.flag_keys)
+        self._global_flags = sum(2 ** self.mask_bits_dict[bit] for bit in self.repeated_flag_keys)
         return
 
     def apply_mask(self, stack, mask_num_images=2, mask_threshold=None, mask_grow=10):
@@ -391,27 +624,16 @@ class PostProcess(SharedTools):
             stack : kbmod.image_stack object
                 The stack after the masks have been applied.
         """
-        mask_bits_dict = self.mask_bits_dict
-        flag_keys = self.flag_keys
-        global_flag_keys = self.repeated_flag_keys
-
-        flags = 0
-        for bit in flag_keys:
-            flags += 2 ** mask_bits_dict[bit]
-
         flag_exceptions = [0]
-        # mask any pixels which have any of these flags
-        global_flags = 0
-        for bit in global_flag_keys:
-            global_flags += 2 ** mask_bits_dict[bit]
 
         # Apply masks if needed.
-        if len(flag_keys) > 0:
-            stack.apply_mask_flags(flags, flag_exceptions)
+        if len(self.flag_keys) > 0:
+            stack.apply_mask_flags(self._flags, flag_exceptions)
         if mask_threshold:
             stack.apply_mask_threshold(mask_threshold)
-        if len(global_flag_keys) > 0:
-            stack.apply_global_mask(global_flags, mask_num_images)
+        # mask any pixels which have any of the global flags
+        if len(self.repeated_flag_keys) > 0:
+            stack.apply_global_mask(self._global_flags, mask_num_images)
 
         # Grow the masks by 'mask_grow' pixels.
         stack.grow_mask(mask_grow, True)
@@ -467,57 +689,62 @@ class PostProcess(SharedTools):
             filter_func = self.apply_kalman_filter
         keep = self.gen_results_dict()
         tmp_results = self.gen_results_dict()
+        # The passing curves of each chunk are collected as blocks and joined
+        # into the final (number of results, number of images) arrays once all
+        # of the chunks are read.
+        psi_blocks = []
+        phi_blocks = []
         likelihood_limit = False
         res_num = 0
         total_count = 0
-        psi_curves = []
-        phi_curves = []
 
-        x_size = search.get_image_stack().get_width()
-        y_size = search.get_image_stack().get_height()
+        chunk_info = (
+            "---------------------------------------\n"
+            "Chunk Start = %i\n"
+            "Chunk Max Likelihood = %.2f\n"
+            "Chunk Min. Likelihood = %.2f\n"
+            "---------------------------------------"
+        )
         print("---------------------------------------")
         print("Retrieving Results")
         print("---------------------------------------")
         while likelihood_limit is False:
             print("Getting results...")
-            tmp_psi_curves = []
-            tmp_phi_curves = []
             results = search.get_results(res_num, chunk_size)
-            print("---------------------------------------")
-            chunk_headers = ("Chunk Start", "Chunk Max Likelihood", "Chunk Min. Likelihood")
-            chunk_values = (res_num, results[0].lh, results[-1].lh)
-            for (
-                header,
-                val,
-            ) in zip(chunk_headers, chunk_values):
-                if type(val) == int:
-                    print("%s = %i" % (header, val))
-                else:
-                    print("%s = %.2f" % (header, val))
-            print("---------------------------------------")
-
-            for i, line in enumerate(results):
-                # Stop as soon as we hit a result below our limit, because anything after
-                # that is not guarrenteed to be valid due to potential on-GPU filtering.
-                if line.lh < lh_level:
-                    likelihood_limit = True
-                    break
-                if line.lh < max_lh:
-                    psi_curve, phi_curve = search.lightcurve(line)
-                    tmp_psi_curves.append(psi_curve)
-                    tmp_phi_curves.append(phi_curve)
-                    total_count += 1
-                        
-            print("Extracted batch of %i results for total of %i" % (np.shape(tmp_psi_curves)[0], total_count))
-            if len(tmp_psi_curves) > 0:
-                tmp_results["psi_curves"] = tmp_psi_curves
-                tmp_results["phi_curves"] = tmp_phi_curves
-                tmp_results["results"] = results
+            print(chunk_info % (res_num, results[0].lh, results[-1].lh))
+
+            # Stop as soon as we hit a result below our limit, because anything after
+            # that is not guarrenteed to be valid due to potential on-GPU filtering.
+            # The results are sorted by descending likelihood, so the cutoff can be
+            # found with a binary search.
+            lh = np.fromiter((line.lh for line in results), dtype=np.float64, count=len(results))
+            num_valid = np.searchsorted(-lh, -lh_level, side="right")
+            if num_valid < len(results):
+                likelihood_limit = True
+            lh = lh[:num_valid]
+            good_results = [results[i] for i in np.flatnonzero(lh < max_lh)]
+
+            # Extract all of the light curves with a single (multithreaded) call
+            # into the C++ code.
+            psi_curves, phi_curves = search.lightcurves_batch(good_results, self.num_cores)
+            total_count += len(good_results)
+
+            print("Extracted batch of %i results for total of %i" % (len(good_results), total_count))
+            if len(good_results) > 0:
+                tmp_results["psi_curves"] = psi_curves
+                tmp_results["phi_curves"] = phi_curves
+                tmp_results["results"] = good_results
                 keep_idx_results = filter_func(tmp_results, filter_params)
-                keep = self.read_filter_results(
-                    keep_idx_results, keep, tmp_psi_curves, tmp_phi_curves, results, mjds, lh_level
+                passing = self._read_filter_results(
+                    keep_idx_results, keep, psi_curves, phi_curves, good_results, mjds, lh_level
                 )
+                psi_blocks.append(np.asarray(psi_curves)[passing].astype(np.float32, copy=False))
+                phi_blocks.append(np.asarray(phi_curves)[passing].astype(np.float32, copy=False))
             res_num += chunk_size
+
+        if len(psi_blocks) > 0:
+            keep["psi_curves"] = np.concatenate(psi_blocks)
+            keep["phi_curves"] = np.concatenate(phi_blocks)
         return keep
 
     def read_filter_results(
@@ -536,10 +763,12 @@ class PostProcess(SharedTools):
                 it should have at least 'psi_curves', 'phi_curves', and
                 'results'. It is a standard results dictionary generated by
                 self.gen_results_dict().
-            psi_curves : list
-                List of psi_curves from kbmod search.
-            phi_curves : list
-                List of phi_curves from kbmod search.
+            psi_curves : numpy array
+                A (number of results, number of images) float32 array of the
+                psi curves from kbmod search.
+            phi_curves : numpy array
+                A (number of results, number of images) float32 array of the
+                phi curves from kbmod search.
             results : list
                 List of results from kbmod search.
             mjds : list
@@ -554,9 +783,39 @@ class PostProcess(SharedTools):
                 'results'. It is a standard results dictionary generated by
                 self.gen_results_dict().
         """
-        masked_phi_curves = np.copy(phi_curves)
-        masked_phi_curves[masked_phi_curves == 0] = 1e9
-        num_good_results = 0
+        passing = self._read_filter_results(
+            keep_idx_results, keep, psi_curves, phi_curves, results, mjds, lh_level
+        )
+
+        # Append the passing curves to the (num_results, num_times) arrays.
+        psi_curves = np.asarray(psi_curves)
+        phi_curves = np.asarray(phi_curves)
+        num_times = psi_curves.shape[1]
+        keep["psi_curves"] = np.concatenate(
+            [np.reshape(keep["psi_curves"], (-1, num_times)), psi_curves[passing]]
+        ).astype(np.float32, copy=False)
+        keep["phi_curves"] = np.concatenate(
+            [np.reshape(keep["phi_curves"], (-1, num_times)), phi_curves[passing]]
+        ).astype(np.float32, copy=False)
+        return keep
+
+    def _read_filter_results(
+        self, keep_idx_results, keep, psi_curves, phi_curves, results, mjds, lh_level
+    ):
+        """
+        Append all of the values except for the psi and phi curves of the
+        results that pass level 1 filtering to a 'keep' dictionary. See
+        read_filter_results() for the inputs.
+        OUTPUT-
+            good_results : list
+                The indices of the passing results within this set of results,
+                used to select their psi and phi curves.
+        """
+        # Compute all of the light curves at once, using zero where phi is zero.
+        psi_curves = np.asarray(psi_curves)
+        phi_curves = np.asarray(phi_curves)
+        lc_all = np.divide(psi_curves, phi_curves, out=np.zeros_like(psi_curves), where=phi_curves != 0)
+        good_results = []
         if len(keep_idx_results[0]) < 3:
             keep_idx_results = [(0, [-1], 0.0)]
         for result_on in range(len(psi_curves)):
@@ -571,14 +830,13 @@ class PostProcess(SharedTools):
                 new_likelihood = keep_idx_results[result_on][2]
                 keep["results"].append(results[result_on])
                 keep["new_lh"].append(new_likelihood)
-                keep["lc"].append(psi_curves[result_on] / masked_phi_curves[result_on])
+                keep["lc"].append(lc_all[result_on])
                 keep["lc_index"].append(keep_idx)
-                keep["psi_curves"].append(psi_curves[result_on])
-                keep["phi_curves"].append(phi_curves[result_on])
                 keep["times"].append(mjds[keep_idx])
-                num_good_results += 1
-        print("Keeping {} results".format(num_good_results))
-        return keep
+                good_results.append(result_on)
+
+        print("Keeping {} results".format(len(good_results)))
+        return good_results
 
     def get_coadd_stamps(self, results, search, keep, radius=10, stamp_type="sum"):
         """
@@ -610,19 +868,11 @@ class PostProcess(SharedTools):
         # python types
         if stamp_type == "cpp_median" or stamp_type == "median":
             num_images = len(keep["psi_curves"][0])
-            boolean_idx = []
-            for keep in keep["lc_index"]:
-                bool_row = np.zeros(num_images)
-                bool_row[keep] = 1
-                boolean_idx.append(bool_row.astype(int).tolist())
+            boolean_idx = _boolean_idx(keep["lc_index"], num_images)
             coadd_stamps = [np.array(stamp) for stamp in search.median_stamps(results, boolean_idx, radius)]
         elif stamp_type == "cpp_mean":
             num_images = len(keep["psi_curves"][0])
-            boolean_idx = []
-            for keep in keep["lc_index"]:
-                bool_row = np.zeros(num_images)
-                bool_row[keep] = 1
-                boolean_idx.append(bool_row.astype(int).tolist())
+            boolean_idx = _boolean_idx(keep["lc_index"], num_images)
             coadd_stamps = [np.array(stamp) for stamp in search.mean_stamps(results, boolean_idx, radius)]
         elif stamp_type == "parallel_sum":
             coadd_stamps = [np.array(stamp) for stamp in search.summed_sci(results, radius)]
@@ -656,10 +906,17 @@ class PostProcess(SharedTools):
         """
         stamp_edge = self.stamp_radius * 2 + 1
         final_results = keep["final_results"]
-        for result in np.array(keep["results"])[final_results]:
-            stamps = search.sci_stamps(result, self.stamp_radius)
-            all_stamps = np.array([np.array(stamp).reshape(stamp_edge, stamp_edge) for stamp in stamps])
-            keep["all_stamps"].append(all_stamps)
+        if final_results is ...:
+            final_results = np.arange(len(keep["results"]))
+
+        # Copy each stamp directly into a single preallocated array.
+        num_times = search.get_num_images()
+        all_stamps = np.empty((len(final_results), num_times, stamp_edge, stamp_edge), dtype=np.float32)
+        for i, result_idx in enumerate(final_results):
+            stamps = search.sci_stamps(keep["results"][result_idx], self.stamp_radius)
+            for j, stamp in enumerate(stamps):
+                all_stamps[i, j] = np.asarray(stamp, dtype=np.float32).reshape(stamp_edge, stamp_edge)
+        keep["all_stamps"] = all_stamps
         return keep
 
     def apply_clipped_sigmaG(self, old_results, filter_params):
@@ -683,11 +940,10 @@ class PostProcess(SharedTools):
         print("Applying Clipped-sigmaG Filtering")
         self.lc_filter_type = filter_params["sigmaG_filter_type"]
         start_time = time.time()
-        # Make copies of the values in 'old_results' and create a new dict
-        psi_curves = np.copy(old_results["psi_curves"])
-        psi_curves[np.isnan(psi_curves)] = 0.0
-        phi_curves = np.copy(old_results["phi_curves"])
-        phi_curves[np.isnan(phi_curves)] = 1e9
+        # The curves are only read. NaNs and zero phi values are handled on the
+        # fly by the C++ filtering, so the curves are not copied or cleaned here.
+        psi_curves = np.asarray(old_results["psi_curves"])
+        phi_curves = np.asarray(old_results["phi_curves"])
 
         if self.coeff is None:
             if self.sigmaG_lims is not None:
@@ -696,20 +952,17 @@ class PostProcess(SharedTools):
                 self.percentiles = [25, 75]
             self.coeff = self._find_sigmaG_coeff(self.percentiles)
 
-        num_curves = len(psi_curves)
-        index_list = [j for j in range(num_curves)]
-        zipped_curves = zip(psi_curves, phi_curves, index_list)
-        keep_idx_results = []
-        if self.num_cores > 1:
-            print("Starting pooling...")
-            pool = mp.Pool(processes=self.num_cores)
-            keep_idx_results = pool.starmap_async(self._clipped_sigmaG, zipped_curves)
-            pool.close()
-            pool.join()
-            keep_idx_results = keep_idx_results.get()
-        else:
-            for z in zipped_curves:
-                keep_idx_results.append(self._clipped_sigmaG(z[0], z[1], z[2]))
+        # Filter all of the curves with a single (multithreaded) call into the
+        # C++ code.
+        keep_mask, new_lh = self._sigmaG_filter_batch(psi_curves, phi_curves)
+
+        # Find the passing indices of all the curves at once and split them by
+        # curve (np.nonzero returns them in row order).
+        num_good = np.count_nonzero(keep_mask, axis=1)
+        good_indices = np.split(np.nonzero(keep_mask)[1], np.cumsum(num_good)[:-1])
+        keep_idx_results = [
+            (i, good_indices[i], new_lh[i]) if num_good[i] > 0 else (i, [-1], 0) for i in range(len(num_good))
+        ]
 
         end_time = time.time()
         time_elapsed = end_time - start_time
@@ -737,23 +990,23 @@ class PostProcess(SharedTools):
         """
         print("Applying Clipped-Average Filtering")
         start_time = time.time()
-        # Make copies of the values in 'old_results' and create a new dict
-        psi_curves = np.copy(old_results["psi_curves"])
-        phi_curves = np.copy(old_results["phi_curves"])
+        psi_curves = np.asarray(old_results["psi_curves"])
+        phi_curves = np.asarray(old_results["phi_curves"])
 
-        zipped_curves = zip(psi_curves, phi_curves, [j for j in range(len(psi_curves))])
-
-        keep_idx_results = []
+        num_curves = len(psi_curves)
         if self.num_cores > 1:
+            # The filter runs in C++ with the GIL released, so threads share
+            # the curves directly without starting or sending data to other
+            # processes.
             print("Starting pooling...")
-            pool = mp.Pool(processes=self.num_cores)
-            keep_idx_results = pool.starmap_async(self._clipped_average, zipped_curves)
-            pool.close()
-            pool.join()
-            keep_idx_results = keep_idx_results.get()
+            with ThreadPoolExecutor(max_workers=self.num_cores) as executor:
+                keep_idx_results = list(
+                    executor.map(_clipped_average_curve, psi_curves, phi_curves, range(num_curves))
+                )
         else:
-            for z in zipped_curves:
-                keep_idx_results.append(self._clipped_average(z[0], z[1], z[2]))
+            keep_idx_results = [
+                _clipped_average_curve(psi_curves[i], phi_curves[i], i) for i in range(num_curves)
+            ]
 
         end_time = time.time()
         time_elapsed = end_time - start_time
@@ -763,12 +1016,7 @@ class PostProcess(SharedTools):
         return keep_idx_results
 
     def _find_sigmaG_coeff(self, percentiles):
-        z1 = percentiles[0] / 100
-        z2 = percentiles[1] / 100
-
-        x1 = self._invert_Gaussian_CDF(z1)
-        x2 = self._invert_Gaussian_CDF(z2)
-        coeff = 1 / (x2 - x1)
+        coeff = _sigmaG_coeff(percentiles[0], percentiles[1])
         print("sigmaG limits: [{},{}]".format(percentiles[0], percentiles[1]))
         print("sigmaG coeff: {:.4f}".format(coeff), flush=True)
         return coeff
@@ -814,48 +1062,50 @@ class PostProcess(SharedTools):
                 The new maximum likelihood of the set of curves, after
                 max_lh_index has been applied.
         """
-        masked_phi = np.copy(phi_curve)
-        masked_phi[masked_phi == 0] = 1e9
-        if self.lc_filter_type == "lh":
-            lh = psi_curve / np.sqrt(masked_phi)
-            good_index = self._exclude_outliers(lh, n_sigma)
-        elif self.lc_filter_type == "flux":
-            flux = psi_curve / masked_phi
-            good_index = self._exclude_outliers(flux, n_sigma)
-        elif self.lc_filter_type == "both":
-            lh = psi_curve / np.sqrt(masked_phi)
-            good_index_lh = self._exclude_outliers(lh, n_sigma)
-            flux = psi_curve / masked_phi
-            good_index_flux = self._exclude_outliers(flux, n_sigma)
-            good_index = np.intersect1d(good_index_lh, good_index_flux)
-        else:
-            print("Invalid filter type, defaulting to likelihood", flush=True)
-            lh = psi_curve / np.sqrt(masked_phi)
-            good_index = self._exclude_outliers(lh, n_sigma)
-
+        psi_curve = np.asarray(psi_curve)
+        phi_curve = np.asarray(phi_curve)
+        keep_mask, new_lh = self._sigmaG_filter_batch(
+            psi_curve[np.newaxis, :], phi_curve[np.newaxis, :], n_sigma
+        )
+        good_index = np.flatnonzero(keep_mask[0])
         if len(good_index) == 0:
-            new_lh = 0
-            good_index = [-1]
-        else:
-            new_lh = kb.calculate_likelihood_psi_phi(psi_curve[good_index], phi_curve[good_index])
-        return (index, good_index, new_lh)
+            return (index, [-1], 0)
+        return (index, good_index, new_lh[0])
 
-    def _exclude_outliers(self, lh, n_sigma):
-        if self.clip_negative:
-            lower_per, median, upper_per = np.percentile(
-                lh[lh > 0], [self.percentiles[0], 50, self.percentiles[1]]
-            )
-            sigmaG = self.coeff * (upper_per - lower_per)
-            nSigmaG = n_sigma * sigmaG
-            good_index = np.where(
-                np.logical_and(lh != 0, np.logical_and(lh > median - nSigmaG, lh < median + nSigmaG))
-            )[0]
-        else:
-            lower_per, median, upper_per = np.percentile(lh, [self.percentiles[0], 50, self.percentiles[1]])
-            sigmaG = self.coeff * (upper_per - lower_per)
-            nSigmaG = n_sigma * sigmaG
-            good_index = np.where(np.logical_and(lh > median - nSigmaG, lh < median + nSigmaG))[0]
-        return good_index
+    def _sigmaG_filter_batch(self, psi_curves, phi_curves, n_sigma=2):
+        """
+        This function applies the clipped-sigmaG filter to a matrix of curves
+        at once, using self.num_cores threads in the C++ code.
+        INPUT-
+            psi_curves : numpy array
+                A (number of curves, number of times) matrix of psi values.
+            phi_curves : numpy array
+                A (number of curves, number of times) matrix of phi values.
+            n_sigma : integer
+                The number of standard deviations away from the median that
+                a value must be in order to be eliminated.
+        OUTPUT-
+            keep_mask : numpy array
+                A boolean matrix the same shape as psi_curves that is True for
+                the values that pass the filtering.
+            new_lh : numpy array
+                The likelihood of each curve computed from only the values
+                that pass the filtering.
+        """
+        filter_types = {"lh": 0, "flux": 1, "both": 2}
+        if self.lc_filter_type not in filter_types:
+            print("Invalid filter type, defaulting to likelihood", flush=True)
+        return kb.sigmag_filter_batch(
+            psi_curves,
+            phi_curves,
+            self.percentiles[0],
+            self.percentiles[1],
+            self.coeff,
+            n_sigma,
+            filter_types.get(self.lc_filter_type, 0),
+            self.clip_negative,
+            self.num_cores,
+        )
 
     def _clipped_average(self, psi_curve, phi_curve, index, num_clipped=5, n_sigma=4, lower_lh_limit=-100):
         """
@@ -897,13 +1147,7 @@ class PostProcess(SharedTools):
                 The new maximum likelihood of the set of curves, after
                 max_lh_index has been applied.
         """
-        max_lh_index = kb.clipped_ave_filtered_indices(psi_curve, phi_curve, num_clipped,
-                                                       n_sigma, lower_lh_limit)
-        new_lh = -1.0
-        if len(max_lh_index) > 0:
-            new_lh = kb.calculate_likelihood_psi_phi(psi_curve[max_lh_index],
-                                                     phi_curve[max_lh_index])
-        return (index, max_lh_index, new_lh)
+        return _clipped_average_curve(psi_curve, phi_curve, index, num_clipped, n_sigma, lower_lh_limit)
 
     def apply_kalman_filter(self, old_results, filter_params):
         """
@@ -923,9 +1167,8 @@ class PostProcess(SharedTools):
         """
         print("Applying Kalman Filtering")
         start_time = time.time()
-        # Make copies of the values in 'old_results' and create a new dict
-        psi_curves = np.copy(old_results["psi_curves"])
-        phi_curves = np.copy(old_results["phi_curves"])
+        psi_curves = np.asarray(old_results["psi_curves"])
+        phi_curves = np.asarray(old_results["phi_curves"])
 
         keep_idx_results = kb.kalman_filtered_indices(psi_curves.tolist(), phi_curves.tolist())
 
@@ -984,45 +1227,48 @@ class PostProcess(SharedTools):
         print("---------------------------------------", flush=True)
         start_time = time.time()
         i = 0
-        passing_stamps_idx = []
         num_results = len(keep["results"])
         if num_results > 0:
             print("Stamp filtering %i results" % num_results)
+
+            # Record which results pass in a single mask and copy the passing
+            # stamps into a buffer sized for the worst case (every result
+            # passing) that is allocated once the stamp shape is known.
+            passing_mask = np.zeros(num_results, dtype=bool)
+            passing_stamps = None
+            num_passing = 0
             while i < num_results:
                 if i + chunk_size < num_results:
                     end_idx = i + chunk_size
                 else:
                     end_idx = num_results
                 stamps_slice = self.get_coadd_stamps(
-                    np.array(keep["results"])[i:end_idx],
+                    keep["results"][i:end_idx],
                     search,
                     keep,
                     stamp_type=stamp_type,
                     radius=stamp_radius,
                 )
 
-                stamp_filt_results = []
-
-                if self.num_cores > 1:
-                    pool = mp.Pool(processes=self.num_cores, maxtasksperchild=1000)
-                    stamp_filt_pool = pool.map_async(self._stamp_filter_parallel, np.copy(stamps_slice))
-                    pool.close()
-                    pool.join()
-                    stamp_filt_results = stamp_filt_pool.get()
-                    del stamp_filt_pool
-                else:
-                    for s in stamps_slice:
-                        res = self._stamp_filter_parallel(s)
-                        stamp_filt_results.append(res)
-
-                passing_stamps_chunk = np.where(np.array(stamp_filt_results) == 1)[0]
-                passing_stamps_idx.append(passing_stamps_chunk + i)
-                keep["stamps"].append(np.array(stamps_slice)[passing_stamps_chunk])
+                # Gather the chunk into a single array (without copying if it
+                # already is one) and filter all of the stamps at once.
+                stamps_slice = np.asarray(stamps_slice)
+                stamp_filt_results = self._stamp_filter_batch(stamps_slice)
+                passing_mask[i:end_idx] = stamp_filt_results
+
+                if passing_stamps is None:
+                    stamps_shape = (num_results,) + stamps_slice.shape[1:]
+                    passing_stamps = np.empty(stamps_shape, dtype=stamps_slice.dtype)
+                chunk_passing = np.count_nonzero(stamp_filt_results)
+                passing_stamps[num_passing : num_passing + chunk_passing] = stamps_slice[stamp_filt_results]
+                num_passing += chunk_passing
                 i += chunk_size
             del stamp_filt_results
-        if len(keep["stamps"]) > 0:
-            keep["stamps"] = np.concatenate(keep["stamps"], axis=0)
-            keep["final_results"] = np.unique(np.concatenate(passing_stamps_idx))
+
+            # Truncate the buffer to the passing stamps, copying so the unused
+            # part of the allocation is released.
+            keep["stamps"] = passing_stamps[:num_passing].copy()
+            keep["final_results"] = np.flatnonzero(passing_mask)
         print("Keeping %i results" % len(keep["final_results"]), flush=True)
         end_time = time.time()
         time_elapsed = end_time - start_time
@@ -1094,7 +1340,11 @@ class PostProcess(SharedTools):
                 individual cluster.
         """
         if self.cluster_function == "DBSCAN":
-            default_cluster_args = dict(eps=self.eps, min_samples=1, n_jobs=-1)
+            # The features are low dimensional, so a k-d tree is used for the
+            # neighborhood queries.
+            default_cluster_args = dict(
+                eps=self.eps, min_samples=1, n_jobs=-1, algorithm="kd_tree", leaf_size=64
+            )
         elif self.cluster_function == "OPTICS":
             default_cluster_args = dict(max_eps=self.eps, min_samples=2, n_jobs=-1)
 
@@ -1102,28 +1352,14 @@ class PostProcess(SharedTools):
             default_cluster_args.update(cluster_args)
         cluster_args = default_cluster_args
 
-        x_arr = []
-        y_arr = []
-        vx_arr = []
-        vy_arr = []
-        vel_arr = []
-        ang_arr = []
         times = mjd_times - mjd_times[0]
 
-        for line in results:
-            x_arr.append(line.x)
-            y_arr.append(line.y)
-            vx_arr.append(line.x_v)
-            vy_arr.append(line.y_v)
-            vel_arr.append(np.sqrt(line.x_v**2.0 + line.y_v**2.0))
-            ang_arr.append(np.arctan2(line.y_v, line.x_v))
-
-        x_arr = np.array(x_arr)
-        y_arr = np.array(y_arr)
-        vx_arr = np.array(vx_arr)
-        vy_arr = np.array(vy_arr)
-        vel_arr = np.array(vel_arr)
-        ang_arr = np.array(ang_arr)
+        # Extract the positions and velocities in a single pass over the results
+        # and compute the derived features on the whole arrays.
+        traj_arr = np.array([(line.x, line.y, line.x_v, line.y_v) for line in results], dtype=float)
+        x_arr, y_arr, vx_arr, vy_arr = traj_arr.reshape(-1, 4).T
+        vel_arr = np.sqrt(vx_arr**2.0 + vy_arr**2.0)
+        ang_arr = np.arctan2(vy_arr, vx_arr)
 
         scaled_x = x_arr / x_size
         scaled_y = y_arr / y_size
@@ -1136,21 +1372,19 @@ class PostProcess(SharedTools):
             cluster = OPTICS(**cluster_args)
 
         if self.cluster_type == "all":
-            cluster.fit(np.array([scaled_x, scaled_y, scaled_vel, scaled_ang], dtype=float).T)
+            cluster.fit(np.column_stack([scaled_x, scaled_y, scaled_vel, scaled_ang]))
         elif self.cluster_type == "position":
-            cluster.fit(np.array([scaled_x, scaled_y], dtype=float).T)
+            cluster.fit(np.column_stack([scaled_x, scaled_y]))
         elif self.cluster_type == "mid_position":
             median_time = np.median(times)
             mid_x_arr = x_arr + median_time * vx_arr
             mid_y_arr = y_arr + median_time * vy_arr
             scaled_mid_x = mid_x_arr / x_size
             scaled_mid_y = mid_y_arr / y_size
-            cluster.fit(np.array([scaled_mid_x, scaled_mid_y], dtype=float).T)
+            cluster.fit(np.column_stack([scaled_mid_x, scaled_mid_y]))
 
-        top_vals = []
-        for cluster_num in np.unique(cluster.labels_):
-            cluster_vals = np.where(cluster.labels_ == cluster_num)[0]
-            top_vals.append(cluster_vals[0])
+        # Take the first (highest likelihood) result of each cluster.
+        _, top_vals = np.unique(cluster.labels_, return_index=True)
 
         del cluster
 
@@ -1169,47 +1403,68 @@ class PostProcess(SharedTools):
                 A 1 (True) or 0 (False) value on whether or not to keep the
                 trajectory.
         """
-        center_thresh = self.center_thresh
+        return int(self._stamp_filter_batch(np.asarray(stamps)[np.newaxis])[0])
+
+    def _stamp_filter_batch(self, stamps):
+        """
+        This function filters a batch of stamps at once, applying the same
+        tests as _stamp_filter_parallel to each stamp.
+        INPUT-
+            stamps : numpy array
+                The pixel values of the stamps, with one stamp (either flat or
+                2D) per trajectory. Stamps will be accepted if they are
+                sufficiently similar to a Gaussian.
+        OUTPUT-
+            keep_stamps : numpy array
+                A boolean array with whether or not to keep each trajectory.
+        """
         x_peak_offset, y_peak_offset = self.peak_offset
         mom_lims = self.mom_lims
-        s = np.copy(stamps)
-        s[np.isnan(s)] = 0.0
-        s = s - np.min(s)
-        stamp_sum = np.sum(s)
-        if stamp_sum != 0:
-            s /= stamp_sum
-        stamp_edge = self.stamp_radius * 2 + 1
-        s = np.array(s, dtype=np.dtype("float64")).reshape(stamp_edge, stamp_edge)
-        mom = measure.moments_central(s, center=(self.stamp_radius, self.stamp_radius))
-        mom_list = [mom[2, 0], mom[0, 2], mom[1, 1], mom[1, 0], mom[0, 1]]
-        peak_1, peak_2 = np.where(s == np.max(s))
-
-        if len(peak_1) > 1:
-            peak_1 = np.max(np.abs(peak_1 - self.stamp_radius))
-
-        if len(peak_2) > 1:
-            peak_2 = np.max(np.abs(peak_2 - self.stamp_radius))
-        if (
-            (mom_list[0] < mom_lims[0])
-            & (mom_list[1] < mom_lims[1])
-            & (np.abs(mom_list[2]) < mom_lims[2])
-            & (np.abs(mom_list[3]) < mom_lims[3])
-            & (np.abs(mom_list[4]) < mom_lims[4])
-            & (np.abs(peak_1 - self.stamp_radius) < x_peak_offset)
-            & (np.abs(peak_2 - self.stamp_radius) < y_peak_offset)
-        ):
-            if center_thresh != 0:
-                if np.max(stamps / np.sum(stamps)) > center_thresh:
-                    keep_stamp = 1
-                else:
-                    keep_stamp = 0
-            else:
-                keep_stamp = 1
-        else:
-            keep_stamp = 0
-        del s
-        del mom_list
-        del peak_1
-        del peak_2
-
-        return keep_stamp
+        radius = self.stamp_radius
+        stamp_edge = radius * 2 + 1
+        stamps = np.asarray(stamps).reshape(-1, stamp_edge, stamp_edge)
+
+        # Reject the stamps that fail the (cheap) center threshold test first,
+        # so the moments are only computed for the remaining candidates.
+        keep_stamps = np.ones(len(stamps), dtype=bool)
+        if self.center_thresh != 0:
+            center_frac = np.max(stamps / np.sum(stamps, axis=(1, 2), keepdims=True), axis=(1, 2))
+            keep_stamps = center_frac > self.center_thresh
+        candidates = np.flatnonzero(keep_stamps)
+        if len(candidates) == 0:
+            return keep_stamps
+
+        # Normalize the stamps to have a minimum of zero and a sum of one. This
+        # is done in place on a single float32 working copy of the candidate
+        # stamps, which is enough precision for the loose moment limits.
+        s = stamps[candidates].astype(np.float32, copy=False)
+        np.nan_to_num(s, copy=False, nan=0.0, posinf=np.inf, neginf=-np.inf)
+        s -= np.min(s, axis=(1, 2), keepdims=True)
+        stamp_sum = np.sum(s, axis=(1, 2), keepdims=True)
+        np.divide(s, stamp_sum, out=s, where=stamp_sum != 0)
+
+        # Compute the central moments of all the stamps with a single matrix
+        # product against the cached moment kernels.
+        dy, dx, kernels = _moment_kernels(radius)
+        mom_xx, mom_yy, mom_xy, mom_x, mom_y = kernels @ s.reshape(len(s), -1).T
+
+        # Find how far the peak is from the center in each direction. When there
+        # are multiple peak pixels, the largest offset is measured from the center
+        # again (as in the per-stamp version).
+        is_peak = s == np.max(s, axis=(1, 2), keepdims=True)
+        multi_peak = np.count_nonzero(is_peak, axis=(1, 2)) > 1
+        peak_1 = np.max(np.where(is_peak, np.abs(dy), -1), axis=(1, 2))
+        peak_1 = np.where(multi_peak, np.abs(peak_1 - radius), peak_1)
+        peak_2 = np.max(np.where(is_peak, np.abs(dx), -1), axis=(1, 2))
+        peak_2 = np.where(multi_peak, np.abs(peak_2 - radius), peak_2)
+
+        keep_stamps[candidates] = (
+            (mom_xx < mom_lims[0])
+            & (mom_yy < mom_lims[1])
+            & (np.abs(mom_xy) < mom_lims[2])
+            & (np.abs(mom_x) < mom_lims[3])
+            & (np.abs(mom_y) < mom_lims[4])
+            & (peak_1 < x_peak_offset)
+            & (peak_2 < y_peak_offset)
+        )
+        return keep_stamps
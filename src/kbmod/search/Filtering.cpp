@@ -8,6 +8,8 @@
 
 #include "Filtering.h"
 #include <math.h>
+#include <omp.h>
+#include <algorithm>
 
 namespace search {
 
@@ -139,6 +141,107 @@ std::vector<int> clippedAverageFilteredIndices(const std::vector<float>& psi_cur
     return passed_indices;
 }
 
+/* Compute the given percentile of already sorted values, using the same linear
+   interpolation as numpy.percentile. */
+static double sortedPercentile(const std::vector<double>& sortedValues, double percentile) {
+    const int last = sortedValues.size() - 1;
+    const double pos = (percentile / 100.0) * last;
+    const int below = static_cast<int>(floor(pos));
+    const int above = std::min(below + 1, last);
+    const double frac = pos - below;
+    const double diff = sortedValues[above] - sortedValues[below];
+    if (frac >= 0.5) {
+        return sortedValues[above] - diff * (1.0 - frac);
+    }
+    return sortedValues[below] + diff * frac;
+}
+
+/* Mark which of the values pass the clipped sigmaG filter. Values that fail are
+   set to false in keep, values that pass are left unchanged. */
+static void sigmaGExcludeOutliers(const std::vector<float>& values, double percentileLow,
+                                  double percentileHigh, double sigmaGCoeff, double nSigma, bool clipNegative,
+                                  bool* keep) {
+    // Collect the values used for the percentiles. A NaN among them makes the
+    // percentiles undefined (as in numpy), so nothing passes.
+    std::vector<double> sorted;
+    bool hasNan = false;
+    for (float val : values) {
+        if (!clipNegative || val > 0.0) {
+            sorted.push_back(val);
+            hasNan = hasNan || std::isnan(val);
+        }
+    }
+
+    // Without any usable values, nothing passes.
+    if (sorted.empty() || hasNan) {
+        std::fill(keep, keep + values.size(), false);
+        return;
+    }
+    std::sort(sorted.begin(), sorted.end());
+
+    const double lowerPer = sortedPercentile(sorted, percentileLow);
+    const double median = sortedPercentile(sorted, 50.0);
+    const double upperPer = sortedPercentile(sorted, percentileHigh);
+    const double sigmaG = sigmaGCoeff * (upperPer - lowerPer);
+    const double nSigmaG = nSigma * sigmaG;
+
+    // Check both bounds with a single comparison.
+    for (int t = 0; t < values.size(); ++t) {
+        const bool passes = fabs(values[t] - median) < nSigmaG;
+        keep[t] = keep[t] && passes && (!clipNegative || values[t] != 0.0);
+    }
+}
+
+void sigmaGFilterBatch(const float* psiCurves, const float* phiCurves, int numCurves, int numTimes,
+                       double percentileLow, double percentileHigh, double sigmaGCoeff, double nSigma,
+                       int filterType, bool clipNegative, int numThreads, bool* keepMask, double* newLh) {
+    omp_set_num_threads(numThreads);
+#pragma omp parallel for
+    for (int i = 0; i < numCurves; ++i) {
+        const float* psi = psiCurves + i * numTimes;
+        const float* phi = phiCurves + i * numTimes;
+        bool* keep = keepMask + i * numTimes;
+
+        // Compute only the likelihood and flux values that the filter type uses in a
+        // single pass. NaN psi values are treated as zero, and NaN or zero phi values
+        // as very large.
+        const bool useLh = (filterType != 1);
+        const bool useFlux = (filterType == 1 || filterType == 2);
+        std::vector<float> psiVals(numTimes);
+        std::vector<float> phiVals(numTimes);
+        std::vector<float> lh(useLh ? numTimes : 0);
+        std::vector<float> flux(useFlux ? numTimes : 0);
+        for (int t = 0; t < numTimes; ++t) {
+            psiVals[t] = std::isnan(psi[t]) ? 0.0 : psi[t];
+            phiVals[t] = std::isnan(phi[t]) ? 1e9 : phi[t];
+            const float maskedPhi = (phiVals[t] == 0.0) ? 1e9 : phiVals[t];
+            if (useLh) lh[t] = psiVals[t] / sqrtf(maskedPhi);
+            if (useFlux) flux[t] = psiVals[t] / maskedPhi;
+            keep[t] = true;
+        }
+
+        if (useFlux) {
+            sigmaGExcludeOutliers(flux, percentileLow, percentileHigh, sigmaGCoeff, nSigma, clipNegative,
+                                  keep);
+        }
+        if (useLh) {
+            sigmaGExcludeOutliers(lh, percentileLow, percentileHigh, sigmaGCoeff, nSigma, clipNegative, keep);
+        }
+
+        // Compute the new likelihood from the passing values.
+        double psiSum = 0.0;
+        double phiSum = 0.0;
+        for (int t = 0; t < numTimes; ++t) {
+            if (keep[t]) {
+                psiSum += psiVals[t];
+                phiSum += phiVals[t];
+            }
+        }
+        newLh[i] = (psiSum == 0.0 || phiSum <= 0.0) ? 0.0 : psiSum / sqrt(phiSum);
+    }
+    omp_set_num_threads(1);
+}
+
 /* Given a set of psi and phi values,
    return a likelihood value */
 double calculateLikelihoodFromPsiPhi(std::vector<double> psiValues, std::vector<double> phiValues) {
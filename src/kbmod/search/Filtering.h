@@ -26,6 +26,15 @@ std::vector<int> clippedAverageFilteredIndices(const std::vector<float>& psi_cur
                                                const std::vector<float>& phi_curve, int num_clipped,
                                                int n_sigma, float lower_lh_limit);
 
+/* Apply the clipped sigmaG filter to a batch of curves stored in row-major (numCurves x numTimes)
+   buffers. The filter is applied to the likelihood (filterType=0), the flux (filterType=1), or
+   both (filterType=2) of each curve. NaN psi values are treated as zero and NaN phi values as
+   1e9. keepMask is filled with whether each value passes, and newLh with the likelihood of
+   each curve computed from only the passing values. */
+void sigmaGFilterBatch(const float* psiCurves, const float* phiCurves, int numCurves, int numTimes,
+                       double percentileLow, double percentileHigh, double sigmaGCoeff, double nSigma,
+                       int filterType, bool clipNegative, int numThreads, bool* keepMask, double* newLh);
+
 double calculateLikelihoodFromPsiPhi(std::vector<double> psiValues, std::vector<double> phiValues);
 
 std::tuple<std::vector<double>, std::vector<double>> calculateKalmanFlux(std::vector<double> fluxValues,
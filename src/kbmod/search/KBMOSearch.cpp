@@ -469,6 +469,33 @@ std::vector<float> KBMOSearch::phiCurves(trajectory& t) {
     return createCurves(t, phiImages);
 }
 
+void KBMOSearch::fillPsiAndPhiCurves(const std::vector<trajectory>& t_array, float* psiOut, float* phiOut,
+                                     int numThreads) {
+    /*Generate the psi and phi lightcurves for a batch of trajectories
+     *  INPUT-
+     *    std::vector<trajectory>& t_array - The trajectories along which to
+     *      find the lightcurves
+     *    float* psiOut - A row-major buffer of size (number of trajectories x
+     *      number of images) that is filled with the psi curves
+     *    float* phiOut - A buffer of the same size that is filled with the
+     *      phi curves
+     *    int numThreads - The number of threads used to fill the buffers
+     */
+    preparePsiPhi();
+    const int numResults = t_array.size();
+    const int numTimes = stack.imgCount();
+
+    omp_set_num_threads(numThreads);
+#pragma omp parallel for
+    for (int s = 0; s < numResults; ++s) {
+        std::vector<float> psi = createCurves(t_array[s], psiImages);
+        std::vector<float> phi = createCurves(t_array[s], phiImages);
+        std::copy(psi.begin(), psi.end(), psiOut + s * numTimes);
+        std::copy(phi.begin(), phi.end(), phiOut + s * numTimes);
+    }
+    omp_set_num_threads(1);
+}
+
 std::vector<RawImage>& KBMOSearch::getPsiImages() { return psiImages; }
 
 std::vector<RawImage>& KBMOSearch::getPhiImages() { return phiImages; }
@@ -98,6 +98,11 @@ public:
     std::vector<float> psiCurves(trajectory& t);
     std::vector<float> phiCurves(trajectory& t);
 
+    // Fill row-major (number of trajectories x number of images) buffers with
+    // the psi and phi curves for many trajectories at once.
+    void fillPsiAndPhiCurves(const std::vector<trajectory>& t_array, float* psiOut, float* phiOut,
+                             int numThreads);
+
     // Save results or internal data products to a file.
     void saveResults(const std::string& path, float fraction);
     void savePsiPhi(const std::string& path);
@@ -189,6 +189,23 @@ PYBIND11_MODULE(search, m) {
             .def("phi_stamps", (std::vector<ri>(ks::*)(tj &, int)) & ks::phiStamps, "set3")
             .def("psi_curves", (std::vector<float>(ks::*)(tj &)) & ks::psiCurves)
             .def("phi_curves", (std::vector<float>(ks::*)(tj &)) & ks::phiCurves)
+            .def(
+                    "lightcurves_batch",
+                    [](ks &s, const std::vector<tj> &t_array, int num_threads) {
+                        const py::ssize_t num_results = t_array.size();
+                        const py::ssize_t num_times = s.numImages();
+                        py::array_t<float> psi({num_results, num_times});
+                        py::array_t<float> phi({num_results, num_times});
+                        float *psi_data = psi.mutable_data();
+                        float *phi_data = phi.mutable_data();
+                        {
+                            // The curves are computed without touching any Python objects.
+                            py::gil_scoped_release release;
+                            s.fillPsiAndPhiCurves(t_array, psi_data, phi_data, num_threads);
+                        }
+                        return py::make_tuple(psi, phi);
+                    },
+                    py::arg("t_array"), py::arg("num_threads") = 1)
             .def("prepare_psi_phi", &ks::preparePsiPhi)
             .def("get_psi_images", &ks::getPsiImages)
             .def("get_phi_images", &ks::getPhiImages)
@@ -265,8 +282,38 @@ PYBIND11_MODULE(search, m) {
     // Functions from Filtering.cpp
     m.def("sigmag_filtered_indices", &search::sigmaGFilteredIndices);
     m.def("kalman_filtered_indices", &search::kalmanFiteredIndices);
-    m.def("clipped_ave_filtered_indices", &search::clippedAverageFilteredIndices);
-    m.def("calculate_likelihood_psi_phi", &search::calculateLikelihoodFromPsiPhi);
+    m.def("clipped_ave_filtered_indices", &search::clippedAverageFilteredIndices,
+          py::call_guard<py::gil_scoped_release>());
+    m.def("calculate_likelihood_psi_phi", &search::calculateLikelihoodFromPsiPhi,
+          py::call_guard<py::gil_scoped_release>());
+    m.def(
+            "sigmag_filter_batch",
+            [](py::array_t<float, py::array::c_style | py::array::forcecast> psi_curves,
+               py::array_t<float, py::array::c_style | py::array::forcecast> phi_curves, double sGL0,
+               double sGL1, double sigmag_coeff, double n_sigma, int filter_type, bool clip_negative,
+               int num_threads) {
+                if (psi_curves.ndim() != 2 || phi_curves.ndim() != 2 ||
+                    psi_curves.shape(0) != phi_curves.shape(0) || psi_curves.shape(1) != phi_curves.shape(1))
+                    throw std::runtime_error("psi_curves and phi_curves must be 2D arrays of the same shape");
+                const py::ssize_t num_curves = psi_curves.shape(0);
+                const py::ssize_t num_times = psi_curves.shape(1);
+                py::array_t<bool> keep_mask({num_curves, num_times});
+                py::array_t<double> new_lh(num_curves);
+                const float *psi_data = psi_curves.data();
+                const float *phi_data = phi_curves.data();
+                bool *keep_data = keep_mask.mutable_data();
+                double *lh_data = new_lh.mutable_data();
+                {
+                    py::gil_scoped_release release;
+                    search::sigmaGFilterBatch(psi_data, phi_data, num_curves, num_times, sGL0, sGL1,
+                                              sigmag_coeff, n_sigma, filter_type, clip_negative, num_threads,
+                                              keep_data, lh_data);
+                }
+                return py::make_tuple(keep_mask, new_lh);
+            },
+            py::arg("psi_curves"), py::arg("phi_curves"), py::arg("sGL0"), py::arg("sGL1"),
+            py::arg("sigmag_coeff"), py::arg("n_sigma"), py::arg("filter_type"), py::arg("clip_negative"),
+            py::arg("num_threads") = 1);
 
     // Functions from TrajectoryUtils (for testing)
     m.def("compute_traj_pos", &search::computeTrajPos);
@@ -18,6 +18,39 @@ def check_and_create_goldens_dir():
         os.mkdir("goldens")
 
 
+def find_ps_file(dir_name, results_suffix):
+    """
+    Find the PS (coadded stamp) file of a set of results.
+
+    Arguments:
+        dir_name - The directory containing the results.
+        results_suffix - The suffix of the results files.
+
+    Returns:
+        The path of the binary ps_<suffix>.npy file, or of the older text
+        ps_<suffix>.txt file if there is no binary one.
+    """
+    file_path = "%s/ps_%s.npy" % (dir_name, results_suffix)
+    if not Path(file_path).is_file():
+        file_path = "%s/ps_%s.txt" % (dir_name, results_suffix)
+    return file_path
+
+
+def load_ps_file(file_name):
+    """
+    Load a PS (coadded stamp) file saved in either the binary or text format.
+
+    Arguments:
+        file_name - The path and filename of the PS file.
+
+    Returns:
+        An array with one row of stamp values per result.
+    """
+    if file_name.endswith(".npy"):
+        return np.load(file_name)
+    return np.loadtxt(file_name, dtype=str)
+
+
 def check_goldens_exist(results_suffix):
     """
     Test whether the needed goldens files exist.
@@ -29,7 +62,7 @@ def check_goldens_exist(results_suffix):
     if not file_path.is_file():
         return False
 
-    file_path = Path("goldens/ps_%s.txt" % results_suffix)
+    file_path = Path(find_ps_file("goldens", results_suffix))
     if not file_path.is_file():
         return False
     return True
@@ -49,9 +82,9 @@ def compare_ps_files(goldens_file, new_results_file, delta=0.00001):
     """
     files_equal = True
 
-    res_new = np.loadtxt(new_results_file, dtype=str)
+    res_new = load_ps_file(new_results_file)
     print("Loaded %i new results from %s." % (len(res_new), new_results_file))
-    res_old = np.loadtxt(goldens_file, dtype=str)
+    res_old = load_ps_file(goldens_file)
     print("Loaded %i old results from %s." % (len(res_old), goldens_file))
 
     # Check that the number of results matches up.
@@ -293,8 +326,8 @@ if __name__ == "__main__":
 
                 # Compare the PS files.
                 if success:
-                    goldens_file = "goldens/ps_%s.txt" % results_suffix
-                    new_results_file = "%s/ps_%s.txt" % (dir_name, results_suffix)
+                    goldens_file = find_ps_file("goldens", results_suffix)
+                    new_results_file = find_ps_file(dir_name, results_suffix)
                     print("Comparing %s and %s" % (goldens_file, new_results_file))
                     success = compare_ps_files(goldens_file, new_results_file)
 
@@ -1,6 +1,13 @@
+import os
+import tempfile
 import unittest
 
+import astropy.units as u
+from astropy.coordinates import SkyCoord, get_body_barycentric, solar_system_ephemeris
+from astropy.time import Time
+
 from kbmod.analysis_utils import *
+from kbmod.analysis_utils import _boolean_idx
 from kbmod.search import *
 
 class test_analysis_utils(unittest.TestCase):
@@ -401,6 +408,169 @@ class test_analysis_utils(unittest.TestCase):
         self.assertIsNotNone(res["stamps"])
         self.assertIsNotNone(res["final_results"])
 
+    def test_read_filter_results(self):
+        kb_post_process = PostProcess(self.config)
+        keep = kb_post_process.gen_results_dict()
+        mjds = np.arange(5, dtype=float)
+        psi_curves = np.arange(15, dtype=np.float32).reshape(3, 5)
+        phi_curves = np.ones((3, 5), dtype=np.float32)
+        results = [trajectory() for _ in range(3)]
+
+        # The second result has too few valid indices and the third is below lh_level.
+        keep_idx_results = [(0, np.array([0, 1, 2, 4]), 20.0), (1, np.array([0, 1]), 20.0), (2, [-1], 0)]
+        keep = kb_post_process.read_filter_results(
+            keep_idx_results, keep, psi_curves, phi_curves, results, mjds, 10.0
+        )
+        self.assertEqual(len(keep["results"]), 1)
+        self.assertEqual(keep["new_lh"], [20.0])
+        self.assertEqual(keep["times"][0].tolist(), [0.0, 1.0, 2.0, 4.0])
+        self.assertEqual(keep["psi_curves"].dtype, np.float32)
+        self.assertTrue(np.array_equal(keep["psi_curves"], psi_curves[[0]]))
+        self.assertTrue(np.array_equal(keep["phi_curves"], phi_curves[[0]]))
+
+        # A second chunk of results is appended to the same arrays.
+        keep_idx_results = [(0, np.array([1, 2, 3]), 15.0), (1, np.array([0, 1, 2]), 12.0), (2, [-1], 0)]
+        keep = kb_post_process.read_filter_results(
+            keep_idx_results, keep, psi_curves, phi_curves, results, mjds, 10.0
+        )
+        self.assertEqual(len(keep["results"]), 3)
+        self.assertTrue(np.array_equal(keep["psi_curves"], psi_curves[[0, 0, 1]]))
+        self.assertEqual(keep["phi_curves"].shape, (3, 5))
+
+    def test_stamp_filter_batch(self):
+        kb_post_process = PostProcess(self.config)
+        kb_post_process.peak_offset = [2.0, 2.0]
+        kb_post_process.mom_lims = [35.5, 35.5, 1.0, 0.25, 0.25]
+        kb_post_process.stamp_radius = 10
+
+        def gaussian(center_y, center_x, sigma):
+            y, x = np.mgrid[0:21, 0:21]
+            dist_sq = (y - center_y) ** 2 + (x - center_x) ** 2
+            return np.exp(-dist_sq / (2 * sigma * sigma)).astype(np.float32)
+
+        # A centered Gaussian, an off-center Gaussian, a stamp with two peak
+        # pixels, a centered Gaussian with a NaN pixel, and a wide Gaussian.
+        multi_peak = np.zeros((21, 21), dtype=np.float32)
+        multi_peak[10, 10] = 1.0
+        multi_peak[10, 11] = 1.0
+        with_nan = gaussian(10, 10, 1.0)
+        with_nan[0, 0] = np.nan
+        stamps = np.array(
+            [gaussian(10, 10, 1.0), gaussian(10, 15, 1.0), multi_peak, with_nan, gaussian(10, 10, 2.5)]
+        )
+
+        # Without a center threshold, the NaN pixel is ignored and the wide
+        # Gaussian passes the moment limits.
+        kb_post_process.center_thresh = 0.0
+        keep = kb_post_process._stamp_filter_batch(stamps)
+        self.assertEqual(keep.tolist(), [True, False, False, True, True])
+
+        # Flattened stamps give the same result, as does filtering one at a time.
+        keep_flat = kb_post_process._stamp_filter_batch(stamps.reshape(5, -1))
+        self.assertEqual(keep_flat.tolist(), keep.tolist())
+        for i in range(5):
+            self.assertEqual(kb_post_process._stamp_filter_parallel(stamps[i]), int(keep[i]))
+
+        # The wide Gaussian only has 2.5% of its flux in the central pixel and
+        # the NaN pixel makes the total flux NaN, so both fail the threshold.
+        kb_post_process.center_thresh = 0.1
+        keep = kb_post_process._stamp_filter_batch(stamps)
+        self.assertEqual(keep.tolist(), [True, False, False, False, False])
+
+    def test_load_visit_values(self):
+        with tempfile.TemporaryDirectory() as dir_name:
+            file_name = os.path.join(dir_name, "times.dat")
+            with open(file_name, "w") as f:
+                f.write("# visit_id mean_julian_date\n")
+                f.write("000101 57130.19\n")
+                f.write("\n")
+                f.write("102.0 57130.25  # second visit\n")
+
+            kb_interface = Interface()
+            visit_times = kb_interface._load_visit_values(file_name)
+            self.assertEqual(list(visit_times.keys()), ["101", "102"])
+            self.assertAlmostEqual(visit_times["101"], 57130.19)
+            self.assertAlmostEqual(visit_times["102"], 57130.25)
+
+    def test_calc_ecliptic_angles(self):
+        wcs = WCS(naxis=2)
+        wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+        wcs.wcs.crval = [200.0, -10.0]
+        wcs.wcs.crpix = [1000.0, 2000.0]
+        wcs.wcs.cdelt = [-0.0002, 0.0002]
+
+        kb_interface = Interface()
+        center_pixels = np.array([[1000.0, 2000.0], [10.0, 20.0], [1500.0, 300.0]])
+        angles = kb_interface._calc_ecliptic_angles(wcs, center_pixels)
+        self.assertEqual(len(angles), 3)
+        for i in range(3):
+            angle = kb_interface._calc_ecliptic_angle(wcs, center_pixels[i])
+            self.assertAlmostEqual(angles[i], angle)
+
+    def _barycentric_corr_lstsq(self, wcslist, mjdlist, x_size, y_size, dist):
+        # The reference implementation, fitting each frame's x and y
+        # corrections separately with a least squares solver. It uses the
+        # builtin ephemeris so the test does not need jplephem or a download.
+        xlist, ylist = np.mgrid[0:x_size, 0:y_size]
+        xlist = xlist.flatten()
+        ylist = ylist.flatten()
+        cobs = wcslist[0].pixel_to_world(xlist, ylist)
+
+        with solar_system_ephemeris.set("builtin"):
+            obs_pos = get_body_barycentric("earth", Time(mjdlist[0], format="mjd"))
+        cobs.representation_type = "cartesian"
+        r2_obs = obs_pos.x * obs_pos.x + obs_pos.y * obs_pos.y + obs_pos.z * obs_pos.z
+        dot = obs_pos.x * cobs.x + obs_pos.y * cobs.y + obs_pos.z * cobs.z
+        bary_dist = dist * u.au
+        r = -dot + np.sqrt(bary_dist * bary_dist - r2_obs + dot * dot)
+        cbary = SkyCoord(
+            obs_pos.x + r * cobs.x,
+            obs_pos.y + r * cobs.y,
+            obs_pos.z + r * cobs.z,
+            representation_type="cartesian",
+        )
+
+        baryCoeff = np.zeros((len(wcslist), 6))
+        for i in range(1, len(wcslist)):
+            with solar_system_ephemeris.set("builtin"):
+                obs_pos = get_body_barycentric("earth", Time(mjdlist[i], format="mjd"))
+            c = SkyCoord(
+                cbary.x - obs_pos.x, cbary.y - obs_pos.y, cbary.z - obs_pos.z, representation_type="cartesian"
+            )
+            c.representation_type = "spherical"
+            pix = wcslist[i].world_to_pixel(c)
+
+            A = np.stack([np.ones_like(xlist), xlist, ylist], axis=-1)
+            coef_x, _, _, _ = np.linalg.lstsq(A, (pix[0] - xlist), rcond=None)
+            coef_y, _, _, _ = np.linalg.lstsq(A, (pix[1] - ylist), rcond=None)
+            baryCoeff[i, 0:3] = coef_x
+            baryCoeff[i, 3:6] = coef_y
+        return baryCoeff
+
+    def test_calc_barycentric_corr(self):
+        wcslist = []
+        for i in range(3):
+            wcs = WCS(naxis=2)
+            wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+            wcs.wcs.crval = [200.0 + 0.01 * i, -10.0 - 0.005 * i]
+            wcs.wcs.crpix = [10.0, 15.0]
+            wcs.wcs.cdelt = [-0.0002, 0.0002]
+            wcslist.append(wcs)
+        mjdlist = np.array([57130.19, 57130.25, 57131.2])
+
+        kb_interface = Interface()
+        baryCoeff = kb_interface._calc_barycentric_corr(wcslist, mjdlist, 20, 30, 50.0, ephemeris="builtin")
+        expected = self._barycentric_corr_lstsq(wcslist, mjdlist, 20, 30, 50.0)
+        self.assertEqual(baryCoeff.shape, (3, 6))
+        self.assertTrue(np.all(baryCoeff[0] == 0.0))
+        self.assertTrue(np.allclose(baryCoeff, expected, rtol=0.0, atol=1e-8))
+
+    def test_boolean_idx(self):
+        lc_index = [np.array([0, 2, 3]), np.array([], dtype=int), np.array([4])]
+        boolean_idx = _boolean_idx(lc_index, 5)
+        self.assertEqual(boolean_idx, [[1, 0, 1, 1, 0], [0, 0, 0, 0, 0], [0, 0, 0, 0, 1]])
+        self.assertEqual(_boolean_idx([], 5), [])
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,56 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from kbmod.analysis.create_stamps import CreateStamps, find_stamp_file
+from kbmod.analysis_utils import Interface
+from kbmod.search import *
+
+
+class test_create_stamps(unittest.TestCase):
+    def test_save_and_load_stamps(self):
+        num_results = 3
+        num_times = 5
+        rng = np.random.default_rng(100)
+
+        kb_interface = Interface()
+        keep = kb_interface.gen_results_dict()
+        for i in range(num_results):
+            trj = trajectory()
+            trj.x = 10 + i
+            trj.y = 20 + i
+            keep["results"].append(trj)
+        keep["new_lh"] = [1.0, 2.0, 3.0]
+        keep["lc"] = [np.ones(num_times) for _ in range(num_results)]
+        keep["lc_index"] = [np.arange(num_times) for _ in range(num_results)]
+        keep["times"] = [np.arange(num_times, dtype=float) for _ in range(num_results)]
+        keep["psi_curves"] = np.ones((num_results, num_times), dtype=np.float32)
+        keep["phi_curves"] = np.ones((num_results, num_times), dtype=np.float32)
+        keep["stamps"] = rng.random((num_results, 21, 21)).astype(np.float32)
+        keep["all_stamps"] = rng.random((num_results, num_times, 21, 21)).astype(np.float32)
+
+        with tempfile.TemporaryDirectory() as dir_name:
+            kb_interface.save_results(dir_name, "test", keep)
+
+            stamp_filename = find_stamp_file(dir_name, "test")
+            self.assertTrue(stamp_filename.endswith("ps_test.npy"))
+            stamps = CreateStamps().load_stamps(stamp_filename)
+            self.assertEqual(stamps.shape, (num_results, 441))
+            self.assertTrue(np.array_equal(stamps, keep["stamps"].reshape(num_results, 441)))
+
+            all_stamps = np.load("%s/all_ps_test.npy" % dir_name)
+            self.assertTrue(np.array_equal(all_stamps, keep["all_stamps"]))
+
+    def test_find_stamp_file_text(self):
+        # Results saved before the binary format are still found.
+        with tempfile.TemporaryDirectory() as dir_name:
+            np.savetxt("%s/ps_test.txt" % dir_name, np.ones((2, 441)))
+            stamp_filename = find_stamp_file(dir_name, "test")
+            self.assertTrue(stamp_filename.endswith("ps_test.txt"))
+            stamps = CreateStamps().load_stamps(stamp_filename)
+            self.assertEqual(stamps.shape, (2, 441))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -93,6 +93,50 @@ class test_kernels_wrappers(unittest.TestCase):
             valid = i != 13 and i != 14 and i != 27
             self.assertEqual(i in inds, valid)
 
+    def test_sigmag_filter_batch(self):
+        # The first curve matches test_sigmag_filtered_indices_one_outlier and
+        # the second curve has no outliers.
+        psi_curves = np.array(
+            [[-1.0, -1.0, -1.0, 0.0, 1.0, 2.0, 2.0, 2.0, 5.46], [1.0, 2.0, 1.0, 2.0, 1.0, 2.0, 1.0, 2.0, 1.0]]
+        )
+        phi_curves = np.ones((2, 9))
+        keep_mask, new_lh = sigmag_filter_batch(psi_curves, phi_curves, 25, 75, 0.7413, 2.0, 0, False)
+        self.assertEqual(keep_mask.shape, (2, 9))
+        self.assertEqual(np.flatnonzero(keep_mask[0]).tolist(), [0, 1, 2, 3, 4, 5, 6, 7])
+        self.assertTrue(np.all(keep_mask[1]))
+        self.assertAlmostEqual(new_lh[0], 4.0 / np.sqrt(8.0), delta=1e-6)
+        self.assertAlmostEqual(new_lh[1], 13.0 / 3.0, delta=1e-6)
+
+        # With negative values clipped, the percentiles only use the positive values
+        # giving bounds of [-0.2065, 7.2065]. The zero value is always filtered.
+        psi_curves[0] = [-1.0, -1.0, 1.0, 2.0, 3.0, 4.0, 5.0, 100.0, 0.0]
+        keep_mask, new_lh = sigmag_filter_batch(psi_curves, phi_curves, 25, 75, 0.7413, 2.0, 0, True, 2)
+        self.assertEqual(np.flatnonzero(keep_mask[0]).tolist(), [2, 3, 4, 5, 6])
+        self.assertTrue(np.all(keep_mask[1]))
+
+        # NaN psi values are treated as zero.
+        psi_nan = np.copy(psi_curves)
+        psi_nan[0, 8] = np.nan
+        keep_mask_nan, new_lh_nan = sigmag_filter_batch(psi_nan, phi_curves, 25, 75, 0.7413, 2.0, 0, True)
+        self.assertTrue(np.array_equal(keep_mask_nan, keep_mask))
+        self.assertTrue(np.allclose(new_lh_nan, new_lh))
+
+    def test_sigmag_filter_batch_both(self):
+        # Value 8 is an outlier only in likelihood (4.0 / sqrt(4.0) = 2.0) and
+        # value 5 is an outlier only in flux (2.0 / 4.0 = 0.5).
+        psi_curves = np.array([[1.0, 1.1, 0.9, 1.05, 1.0, 2.0, 0.95, 1.0, 4.0]])
+        phi_curves = np.array([[1.0, 1.0, 1.0, 1.0, 1.0, 4.0, 1.0, 1.0, 4.0]])
+
+        keep_mask, _ = sigmag_filter_batch(psi_curves, phi_curves, 25, 75, 0.7413, 2.0, 0, False)
+        self.assertEqual(np.flatnonzero(~keep_mask[0]).tolist(), [1, 2, 8])
+        keep_mask, _ = sigmag_filter_batch(psi_curves, phi_curves, 25, 75, 0.7413, 2.0, 1, False)
+        self.assertEqual(np.flatnonzero(~keep_mask[0]).tolist(), [1, 2, 5])
+
+        # Filtering on both only keeps the values that pass both filters.
+        keep_mask, new_lh = sigmag_filter_batch(psi_curves, phi_curves, 25, 75, 0.7413, 2.0, 2, False)
+        self.assertEqual(np.flatnonzero(~keep_mask[0]).tolist(), [1, 2, 5, 8])
+        self.assertAlmostEqual(new_lh[0], 5.0 / np.sqrt(5.0), delta=1e-6)
+
     def test_kalman_filtered_indices(self):
         # With everything the same, nothing should be filtered.
         psi_values = [[1.0 for _ in range(20)] for _ in range(20)]
@@ -125,6 +125,20 @@ class test_search(unittest.TestCase):
                     )
                     self.assertAlmostEqual(phi[1].get_pixel(x, y), 1.0 / var.get_pixel(x, y), delta=1e-6)
 
+    def test_lightcurves_batch(self):
+        results = self.search.get_results(0, 10)
+        psi_curves, phi_curves = self.search.lightcurves_batch(results)
+        self.assertEqual(psi_curves.shape, (10, self.imCount))
+        self.assertEqual(phi_curves.shape, (10, self.imCount))
+
+        # Each row should match the single trajectory curves.
+        for i in range(10):
+            psi = self.search.psi_curves(results[i])
+            phi = self.search.phi_curves(results[i])
+            for j in range(self.imCount):
+                self.assertAlmostEqual(psi_curves[i][j], psi[j], delta=1e-6)
+                self.assertAlmostEqual(phi_curves[i][j], phi[j], delta=1e-6)
+
     def test_results(self):
         results = self.search.get_results(0, 10)
         best = results[0]